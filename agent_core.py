@@ -1,6 +1,19 @@
+import atexit
+import hashlib
+import json
 import os
+import queue
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
 from datetime import datetime
 from typing import Dict, Optional
+
+from concurrent.futures import Future
+
+import numpy as np
 from dotenv import load_dotenv
 
 from langchain_core.chat_history import InMemoryChatMessageHistory
@@ -27,9 +40,210 @@ except ImportError:
     # Fallback to langchain_community for older versions
     from langchain_community.vectorstores import Chroma
 
+try:
+    from langchain_huggingface import HuggingFaceEmbeddings
+except ImportError:
+    try:
+        from langchain_community.embeddings import HuggingFaceEmbeddings
+    except ImportError:
+        # Optional: without sentence-transformers, embeddings stay remote
+        HuggingFaceEmbeddings = None
+
+try:
+    import faiss
+except ImportError:
+    # Optional: without FAISS, memory retrieval queries Chroma directly
+    faiss = None
+
+try:
+    import ahocorasick
+except ImportError:
+    # Optional: without pyahocorasick, name extraction uses the regex scan
+    ahocorasick = None
+
 from skills.code_runner import CodeRunnerSkill
 from skills.time_tool import TimeTool
 from skills.web_search import WebSearchSkill
+from utils.sqlite_vec_store import SqliteVecStore
+
+# Precompiled name-extraction patterns - compiled once at import instead of
+# on every message. A single alternation covers all trigger phrases, and
+# re.IGNORECASE avoids lowercasing the whole message per turn.
+_NAME_RE = re.compile(
+    r"(?:my name is|i am|i'm|call me|save my name as|remember my name as|name is|name's)"
+    r"\s+([A-Za-z][A-Za-z\s]{0,40})",
+    re.IGNORECASE,
+)
+_NAME_TOKEN_RE = re.compile(r"^([A-Za-z]+(?:\s+[A-Za-z]+){0,2})")
+
+# Aho-Corasick automaton over the trigger phrases: one linear pass with no
+# backtracking, regardless of how many phrases are registered.
+_NAME_TRIGGERS = (
+    "my name is", "i am", "i'm", "call me",
+    "save my name as", "remember my name as", "name is", "name's",
+)
+# Above this size the automaton's lowercased copy of the message costs more
+# than it saves; the IGNORECASE regex scans the original string copy-free
+_LOWERCASE_SCAN_LIMIT = 4096
+
+# Memory retrieval is skipped entirely for queries this short or for plain
+# greetings - they embed and search for nothing useful
+_SHORT_QUERY_TOKENS = 4
+_GREETINGS = frozenset({
+    "hi", "hello", "hey", "yo", "ok", "okay", "thanks", "thank you",
+    "bye", "goodbye", "good morning", "good night", "cool", "nice",
+})
+
+if ahocorasick is not None:
+    _NAME_AUTOMATON = ahocorasick.Automaton()
+    for _phrase in _NAME_TRIGGERS:
+        _NAME_AUTOMATON.add_word(_phrase, len(_phrase))
+    _NAME_AUTOMATON.make_automaton()
+else:
+    _NAME_AUTOMATON = None
+
+
+class BoundedChatMessageHistory(InMemoryChatMessageHistory):
+    """Chat history backed by a deque(maxlen=...) so appends are O(1) and old
+    turns fall off automatically - no per-turn slicing or list reassignment."""
+
+    def __init__(self, max_messages: int) -> None:
+        super().__init__()
+        # Bypass pydantic field coercion so the deque (and its maxlen) survives
+        object.__setattr__(self, "messages", deque(maxlen=max_messages))
+
+
+class BatchingEmbedder:
+    """Coalesces concurrent embedding requests into single batched calls.
+
+    Callers block on a Future while a background thread drains up to
+    max_batch queued texts (waiting at most max_wait_seconds for stragglers
+    once the first text arrives) and runs one forward pass through the
+    wrapped embeddings object. Under concurrent Flask requests this turns N
+    sequential encoder calls into one batched call.
+    """
+
+    def __init__(self, embeddings, max_batch: int = 32, max_wait_seconds: float = 0.008) -> None:
+        self._embeddings = embeddings
+        self._max_batch = max_batch
+        self._max_wait = max_wait_seconds
+        self._queue: queue.Queue = queue.Queue()
+        self._worker = threading.Thread(target=self._worker_loop, daemon=True)
+        self._worker.start()
+
+    def embed_query(self, text: str) -> list:
+        future: Future = Future()
+        self._queue.put((text, future))
+        return future.result()
+
+    def embed_documents(self, texts: list) -> list:
+        if not texts:
+            return []
+        futures = [Future() for _ in texts]
+        for text, future in zip(texts, futures):
+            self._queue.put((text, future))
+        return [future.result() for future in futures]
+
+    def _worker_loop(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self._max_wait
+            while len(batch) < self._max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._run_batch(batch)
+
+    def _run_batch(self, batch: list) -> None:
+        texts = [text for text, _ in batch]
+        try:
+            vectors = self._embeddings.embed_documents(texts)
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        for (_, future), vector in zip(batch, vectors):
+            future.set_result(vector)
+
+
+class QueryCache:
+    """Thread-safe LRU+TTL cache for memory-retrieval results.
+
+    Exact repeats are served from a hash-keyed LRU. Near-duplicate queries are
+    matched against a small ring buffer of recent query embeddings via a dot
+    product (Gemini embeddings are L2-normalized, so that is the cosine).
+    Stored results are tagged with a collection version so the whole cache can
+    be invalidated cheaply whenever new memories are written.
+    """
+
+    def __init__(self, max_size: int = 512, ttl_seconds: float = 300.0,
+                 ring_size: int = 32, similarity_threshold: float = 0.95) -> None:
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self._lock = threading.RLock()
+        self._entries: OrderedDict = OrderedDict()  # key -> (result, expires_at, version)
+        self._ring: deque = deque(maxlen=ring_size)  # (vector, result, expires_at, version)
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(query: str, k: int) -> bytes:
+        """Hash the normalized query (plus k) into a compact cache key."""
+        normalized = f"{k}:{query.strip().lower()}"
+        return hashlib.blake2b(normalized.encode("utf-8"), digest_size=16).digest()
+
+    def get(self, key: bytes) -> Optional[str]:
+        """Return a cached result for an exact query repeat, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            result, expires_at, version = entry
+            if version != self.version or expires_at < time.monotonic():
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return result
+
+    def get_similar(self, vector: np.ndarray) -> Optional[str]:
+        """Return a cached result whose query embedding is cosine-close, or None."""
+        now = time.monotonic()
+        with self._lock:
+            for cached_vec, result, expires_at, version in self._ring:
+                if version != self.version or expires_at < now:
+                    continue
+                if float(np.dot(cached_vec, vector)) >= self.similarity_threshold:
+                    self.hits += 1
+                    return result
+            self.misses += 1
+            return None
+
+    def put(self, key: bytes, result: str, vector: Optional[np.ndarray] = None) -> None:
+        """Store a retrieval result under its key (and embedding, if available)."""
+        expires_at = time.monotonic() + self.ttl_seconds
+        with self._lock:
+            self._entries[key] = (result, expires_at, self.version)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            if vector is not None:
+                self._ring.append((vector, result, expires_at, self.version))
+
+    def invalidate(self) -> None:
+        """Mark all cached results stale (called when new memories are stored)."""
+        with self._lock:
+            self.version += 1
 
 
 class MaddyBotAgent:
@@ -63,11 +277,24 @@ class MaddyBotAgent:
             timeout=30,  # 30 second timeout
             convert_system_message_to_human=True,  # Gemini compatibility
         )
-        self.chat_history = InMemoryChatMessageHistory()
-        
-        # Create a prompt template that includes chat history
+        # Vision variant built once alongside the text client: reusing the
+        # client keeps the HTTP/2 channel and auth warm instead of paying
+        # connection setup on every vision request
+        self.vision_llm = ChatGoogleGenerativeAI(
+            model="gemini-2.5-flash",
+            google_api_key=self.api_key,
+            temperature=0.7,
+            max_output_tokens=1024,  # Reduced for faster responses
+            timeout=30,  # 30 second timeout
+        )
+        self.chat_history = BoundedChatMessageHistory(self.max_history_messages)
+
+        # Build the prompt template once; per turn only the system prompt
+        # string is partial-formatted in, avoiding a from_messages reparse
+        self._system_header = "You are MaddyBot, a helpful AI assistant. Be friendly, concise, and direct. Keep responses brief unless detailed explanation is requested."
+        self._name_template = "IMPORTANT: The user's name is {name}. Always use this name when addressing them. Remember this name for future conversations."
         self.prompt = ChatPromptTemplate.from_messages([
-            ("system", "You are MaddyBot, a helpful AI assistant. Be friendly, concise, and direct. Keep responses brief unless detailed explanation is requested."),
+            ("system", "{system_prompt}"),
             MessagesPlaceholder(variable_name="history"),
             ("human", "{input}"),
         ])
@@ -77,9 +304,42 @@ class MaddyBotAgent:
         self.vectorstore = None
         self.user_info_store = None  # Separate store for user information
         
-        # Cache for user information (loaded once per session)
-        self.user_info_cache = None
+        # Cache for user information, persisted as a plain JSON sidecar so
+        # startup never needs an embedding call just to recover the name
+        self.user_info_cache = {}
         self.user_info_loaded = False
+        self._user_info_path = os.path.join(self.memory_path, "user_info.json")
+        try:
+            with open(self._user_info_path, "r", encoding="utf-8") as f:
+                self.user_info_cache = json.load(f)
+            self.user_info_loaded = True
+        except FileNotFoundError:
+            pass  # First run or pre-sidecar memory dir - recover from Chroma once
+        except Exception as e:
+            print(f"Warning: Could not read user info cache: {e}")
+
+        # Cache for memory-retrieval results (skips repeat embedding + search)
+        self.query_cache = QueryCache()
+
+        # In-memory FAISS index over conversation memory (primary query path);
+        # Chroma stays the durable store, written in batches from the
+        # background storage thread.
+        self._faiss_index = None
+        self._faiss_docs = []
+        self._index_ready = False
+        self._index_lock = threading.Lock()
+        self._query_buf = None  # Reusable (1, dim) float32 buffer for searches
+        self._pending_flush = []
+        self._flush_every = 16
+        self._vector_count = -1  # Stored-memory count; -1 until the store opens
+
+        # Background storage worker: exchanges are queued per turn and
+        # written in size/time-triggered batches instead of one-at-a-time
+        self._store_queue: queue.Queue = queue.Queue()
+        self._store_flush_seconds = 2.0
+        self._store_worker = None
+        self._store_worker_lock = threading.Lock()
+        atexit.register(self._flush_pending)
 
         self.skills: Dict[str, object] = {
             "web_search": WebSearchSkill(),
@@ -87,38 +347,118 @@ class MaddyBotAgent:
             "time_tool": TimeTool(),
         }
 
+        # Warm the vectorstore off the request thread so the first turn
+        # doesn't pay for store + embeddings-client construction
+        self._init_lock = threading.Lock()
+        self._init_done = threading.Event()
+        threading.Thread(target=self._initialize_vectorstore, daemon=True).start()
+
     def _get_recent_history(self):
-        """Get only recent messages to limit context size."""
-        messages = self.chat_history.messages
-        if len(messages) > self.max_history_messages:
-            return messages[-self.max_history_messages:]
-        return messages
+        """Get recent messages; the deque's maxlen already bounds the size."""
+        return list(self.chat_history.messages)
 
     def _initialize_vectorstore(self):
-        """Lazy initialization of vectorstore with Google embeddings."""
-        if self.vectorstore is None:
-            # Use Google's embeddings (faster and better quality)
+        """Initialize vectorstore and embeddings (idempotent, thread-safe).
+
+        Kicked off from __init__ on a daemon thread so the first interactive
+        turn usually finds everything ready; request-path callers hit the
+        event fast-path and skip the lock entirely.
+        """
+        if self._init_done.is_set():
+            return
+        with self._init_lock:
+            if self.vectorstore is None:
+                self._build_vectorstore()
+            if self.vectorstore is not None:
+                self._init_done.set()
+
+    def _build_vectorstore(self):
+        """Construct embeddings, durable store, and the RAM index."""
+        if HuggingFaceEmbeddings is not None:
+            # Local 384-D MiniLM: single-digit-ms CPU embeds with no API
+            # round-trip. Note: a memory dir created with Gemini embeddings
+            # has a different dimension and needs a fresh directory.
+            self.embeddings = HuggingFaceEmbeddings(
+                model_name="sentence-transformers/all-MiniLM-L6-v2",
+                encode_kwargs={"normalize_embeddings": True},
+            )
+        else:
+            # Fall back to Google's remote embeddings
             self.embeddings = GoogleGenerativeAIEmbeddings(
                 model="models/embedding-001",
                 google_api_key=self.api_key,
             )
+        # Coalesce concurrent embed calls into single batched passes
+        self.embeddings = BatchingEmbedder(self.embeddings)
+        # Prefer the embedded sqlite-vec store (single file, in-process
+        # KNN); fall back to Chroma when sqlite-vec is not installed
+        self.vectorstore = SqliteVecStore.create(
+            os.path.join(self.memory_path, "memory.db"),
+            embedding_function=self.embeddings,
+        )
+        if self.vectorstore is None:
             self.vectorstore = Chroma(
                 collection_name="maddybot-memory",
                 persist_directory=self.memory_path,
                 embedding_function=self.embeddings,
             )
-            # Initialize user info store
-            self.user_info_store = Chroma(
-                collection_name="maddybot-user-info",
-                persist_directory=self.memory_path,
-                embedding_function=self.embeddings,
+        # Initialize user info store
+        self.user_info_store = Chroma(
+            collection_name="maddybot-user-info",
+            persist_directory=self.memory_path,
+            embedding_function=self.embeddings,
+        )
+        try:
+            if isinstance(self.vectorstore, SqliteVecStore):
+                self._vector_count = self.vectorstore.count()
+            else:
+                self._vector_count = self.vectorstore._collection.count()
+        except Exception:
+            self._vector_count = -1  # Unknown - don't gate retrieval on it
+        if faiss is not None:
+            self._build_memory_index()
+
+    def _build_memory_index(self):
+        """Load persisted vectors from the durable store once and build a RAM FAISS index."""
+        try:
+            data = self.vectorstore.get(include=["embeddings", "documents"])
+            documents = data.get("documents") or []
+            embeddings = data.get("embeddings")
+            with self._index_lock:
+                if embeddings is not None and len(embeddings) > 0:
+                    vectors = np.ascontiguousarray(embeddings, dtype=np.float32)
+                    faiss.normalize_L2(vectors)
+                    self._faiss_index = faiss.IndexFlatIP(vectors.shape[1])
+                    self._faiss_index.add(vectors)
+                    self._faiss_docs = list(documents)
+                self._index_ready = True
+        except Exception as e:
+            print(f"Warning: Could not build in-memory index: {e}")
+
+    def _search_memory_index(self, query_vector: np.ndarray, k: int):
+        """Search the in-memory index; returns None when FAISS is unavailable."""
+        if faiss is None or not self._index_ready:
+            return None
+        with self._index_lock:
+            if self._faiss_index is None or self._faiss_index.ntotal == 0:
+                return []
+            # Reuse one contiguous float32 buffer so the C boundary never
+            # copies or allocates per query
+            dim = query_vector.shape[0]
+            if self._query_buf is None or self._query_buf.shape[1] != dim:
+                self._query_buf = np.empty((1, dim), dtype=np.float32)
+            np.copyto(self._query_buf[0], query_vector)
+            faiss.normalize_L2(self._query_buf)
+            _, indices = self._faiss_index.search(
+                self._query_buf, min(k, self._faiss_index.ntotal)
             )
+            return [self._faiss_docs[i] for i in indices[0] if i >= 0]
 
     def _load_user_info(self):
-        """Load user information from persistent storage."""
+        """Load user information (JSON sidecar; legacy Chroma store as fallback)."""
         if self.user_info_loaded:
             return self.user_info_cache
-        
+
         self.user_info_cache = {}
         try:
             self._initialize_vectorstore()
@@ -137,203 +477,371 @@ class MaddyBotAgent:
                                     break
         except Exception as e:
             print(f"Warning: Could not load user info: {e}")
-        
+
         self.user_info_loaded = True
+        if self.user_info_cache:
+            # Migrate the recovered info to the sidecar for the next startup
+            self._write_user_info_cache()
         return self.user_info_cache
     
     def _extract_user_info(self, message: str) -> Dict[str, str]:
         """Extract user information from message (name, preferences, etc.)."""
         info = {}
-        message_lower = message.lower()
-        
-        # Extract name patterns - handle multi-word names
-        name_patterns = [
-            r"(?:my name is|i am|i'm|call me|save my name as|remember my name as)\s+([A-Za-z\s]+?)(?:\s|$|\.|,|!)",
-            r"(?:name is|name's)\s+([A-Za-z\s]+?)(?:\s|$|\.|,|!)",
-        ]
-        
-        import re
-        for pattern in name_patterns:
-            match = re.search(pattern, message_lower)
+
+        if _NAME_AUTOMATON is not None and len(message) <= _LOWERCASE_SCAN_LIMIT:
+            # Linear-time trigger-phrase scan; the name tokens are then read
+            # from the original-case message just past the trigger. The
+            # lowercased copy is bounded by _LOWERCASE_SCAN_LIMIT.
+            for end_index, _phrase_len in _NAME_AUTOMATON.iter(message.lower()):
+                name_match = _NAME_TOKEN_RE.match(message[end_index + 1:].lstrip())
+                if name_match:
+                    name = name_match.group(1).strip()
+                    if len(name) > 1:
+                        info["name"] = name
+                        break
+        else:
+            # Single IGNORECASE scan over the original string - no lowercased
+            # copy, and the match group keeps the original casing
+            match = _NAME_RE.search(message)
             if match:
-                # Get the original case from the message
-                start_pos = message_lower.find(match.group(0))
-                if start_pos != -1:
-                    name_part = message[start_pos + len(match.group(0).split()[-1]):]
-                    # Extract just the name part
-                    name_match = re.search(r"([A-Za-z]+(?:\s+[A-Za-z]+)*)", name_part)
-                    if name_match:
-                        name = name_match.group(1).strip()
-                        if len(name) > 1:
-                            info["name"] = name
-                            break
-        
-        # Fallback: simpler extraction (handles "save my name as Maadhu")
-        if not info.get("name"):
-            # Try to find name after common phrases
-            phrases = ["save my name as", "remember my name as", "my name is", "i am", "i'm", "call me"]
-            for phrase in phrases:
-                if phrase in message_lower:
-                    idx = message_lower.find(phrase) + len(phrase)
-                    remaining = message[idx:].strip()
-                    # Extract first word or words (up to 3 words for names like "John Smith")
-                    name_match = re.match(r"^([A-Za-z]+(?:\s+[A-Za-z]+){0,2})", remaining)
-                    if name_match:
-                        name = name_match.group(1).strip()
-                        if len(name) > 1:
-                            info["name"] = name
-                            break
-        
+                # Limit to at most 3 tokens for names like "John Smith"
+                name_match = _NAME_TOKEN_RE.match(match.group(1).strip())
+                if name_match:
+                    name = name_match.group(1).strip()
+                    if len(name) > 1:
+                        info["name"] = name
+
         return info
     
+    def _write_user_info_cache(self):
+        """Atomically persist the user-info cache to its JSON sidecar."""
+        try:
+            tmp_path = self._user_info_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.user_info_cache, f)
+            os.replace(tmp_path, self._user_info_path)
+        except Exception as e:
+            print(f"Warning: Could not write user info cache: {e}")
+
     def _store_user_info(self, info: Dict[str, str]):
-        """Store user information persistently."""
+        """Store user information persistently (sidecar first, Chroma as backup)."""
         if not info:
             return
-        
-        try:
-            self._initialize_vectorstore()
-            if self.user_info_store:
-                # Create document with user info
-                content_parts = []
-                for key, value in info.items():
-                    content_parts.append(f"{key}: {value}")
-                
-                document = Document(
-                    page_content="\n".join(content_parts),
-                    metadata={
-                        "type": "user_info",
-                        "timestamp": datetime.utcnow().isoformat(),
-                    },
-                )
-                self.user_info_store.add_documents([document])
-                # Update cache
-                self.user_info_cache.update(info)
-                print(f"Stored user info: {info}")
-        except Exception as e:
-            print(f"Warning: Could not store user info: {e}")
+
+        self.user_info_cache.update(info)
+        self._write_user_info_cache()
+        print(f"Stored user info: {info}")
+
+        # The Chroma backup rides the same background storage queue as
+        # interactions - the request path never waits on vectorstore init
+        self._ensure_store_worker()
+        self._store_queue.put(("user_info", (dict(info), datetime.utcnow().isoformat())))
 
     def _retrieve_relevant_memory(self, query: str, k: int = 3) -> str:
         """Retrieve relevant past conversations from vectorstore."""
         try:
+            # Cheap gating: greetings and very short messages never benefit
+            # from a memory lookup, so skip the embedding call outright
+            stripped = query.strip()
+            if not stripped or stripped.lower() in _GREETINGS:
+                return ""
+            if len(stripped.split()) < _SHORT_QUERY_TOKENS:
+                return ""
+
+            # Exact repeat of a recent query - no embedding call needed
+            cache_key = QueryCache.make_key(query, k)
+            cached = self.query_cache.get(cache_key)
+            if cached is not None:
+                return cached
+
             self._initialize_vectorstore()
             if self.vectorstore is None:
                 return ""
-            
-            # Search for relevant past conversations
-            results = self.vectorstore.similarity_search(query, k=k)
-            if not results:
+
+            # Nothing stored yet - no point embedding the query
+            if self._vector_count == 0:
                 return ""
-            
-            # Format retrieved memories
-            memory_parts = []
-            for doc in results:
-                memory_parts.append(doc.page_content)
-            
-            return "\n\n--- Relevant Past Conversations ---\n" + "\n\n---\n".join(memory_parts)
+
+            # Embed once, then check for a near-duplicate recent query
+            query_vector = np.ascontiguousarray(
+                self.embeddings.embed_query(query), dtype=np.float32
+            )
+            similar = self.query_cache.get_similar(query_vector)
+            if similar is not None:
+                self.query_cache.put(cache_key, similar)
+                return similar
+
+            # Search the in-memory index first (reusing the embedding);
+            # fall back to Chroma when FAISS is not installed
+            memory_parts = self._search_memory_index(query_vector, k)
+            if memory_parts is None:
+                results = self.vectorstore.similarity_search_by_vector(query_vector.tolist(), k=k)
+                memory_parts = [doc.page_content for doc in results]
+
+            if not memory_parts:
+                self.query_cache.put(cache_key, "", query_vector)
+                return ""
+
+            memory = "\n\n--- Relevant Past Conversations ---\n" + "\n\n---\n".join(memory_parts)
+            self.query_cache.put(cache_key, memory, query_vector)
+            return memory
         except Exception as e:
             print(f"Warning: Could not retrieve memory: {e}")
             return ""
 
+    def _prepare_chain(self, message: str):
+        """Shared per-turn setup: user info, memory retrieval, prompt, chain."""
+        # Load user information
+        user_info = self._load_user_info()
+
+        # Extract new user information from message
+        extracted_info = self._extract_user_info(message)
+        if extracted_info:
+            self._store_user_info(extracted_info)
+            user_info.update(extracted_info)
+
+        # Retrieve relevant past conversations from database
+        relevant_memory = self._retrieve_relevant_memory(message, k=2)
+
+        # Build system message with user info
+        system_message = self._build_system_message(user_info, relevant_memory)
+
+        # Get only recent history to reduce context size
+        recent_history = self._get_recent_history()
+
+        # Reuse the cached template; only the system string varies per turn
+        prompt_with_info = self.prompt.partial(system_prompt=system_message)
+
+        # Build the chain with limited history
+        return (
+            RunnablePassthrough.assign(
+                history=lambda _: recent_history
+            )
+            | prompt_with_info
+            | self.llm
+        )
+
+    def _build_system_message(self, user_info: Dict[str, str], relevant_memory: str) -> str:
+        """Assemble the system prompt with a single join instead of repeated
+        += concatenation (retrieved memory blobs can be multiple KB)."""
+        parts = [self._system_header]
+        if user_info.get("name"):
+            parts.append(self._name_template.format(name=user_info["name"]))
+        if relevant_memory:
+            parts.append(relevant_memory)
+        return "\n\n".join(parts)
+
+    def _finalize_reply(self, message: str, reply: str) -> None:
+        """Record the exchange in history and queue it for storage."""
+        # The bounded deque drops the oldest messages on its own
+        self.chat_history.add_message(HumanMessage(content=message))
+        self.chat_history.add_message(AIMessage(content=reply))
+
+        # Store interaction in background (non-blocking, batched)
+        self._enqueue_interaction(message, reply)
+
     def process_message(self, message: str) -> str:
         """Generate a reply using LangChain and update persistent memory."""
         try:
-            # Load user information
-            user_info = self._load_user_info()
-            
-            # Extract new user information from message
-            extracted_info = self._extract_user_info(message)
-            if extracted_info:
-                self._store_user_info(extracted_info)
-                user_info.update(extracted_info)
-            
-            # Retrieve relevant past conversations from database
-            relevant_memory = self._retrieve_relevant_memory(message, k=2)
-            
-            # Build system message with user info
-            system_message = "You are MaddyBot, a helpful AI assistant. Be friendly, concise, and direct. Keep responses brief unless detailed explanation is requested."
-            if user_info.get("name"):
-                system_message += f"\n\nIMPORTANT: The user's name is {user_info['name']}. Always use this name when addressing them. Remember this name for future conversations."
-            
-            if relevant_memory:
-                system_message += f"\n\n{relevant_memory}"
-            
-            # Get only recent history to reduce context size
-            recent_history = self._get_recent_history()
-            
-            # Create prompt with user info and memory
-            prompt_with_info = ChatPromptTemplate.from_messages([
-                ("system", system_message),
-                MessagesPlaceholder(variable_name="history"),
-                ("human", "{input}"),
-            ])
-            
-            # Build the chain with limited history
-            chain = (
-                RunnablePassthrough.assign(
-                    history=lambda _: recent_history
-                )
-                | prompt_with_info
-                | self.llm
-            )
-            
+            chain = self._prepare_chain(message)
+
             # Invoke the conversation chain (timeout handled by LLM)
             response = chain.invoke({"input": message})
-            
+
             # Extract the reply text
             reply = response.content if hasattr(response, 'content') else str(response)
-            
+
             if not reply or reply.strip() == "":
                 reply = "I'm sorry, I couldn't generate a response. Please try again."
-            
-            # Update chat history after getting response
-            self.chat_history.add_message(HumanMessage(content=message))
-            self.chat_history.add_message(AIMessage(content=reply))
-            
-            # Limit history size to prevent it from growing too large
-            messages = self.chat_history.messages
-            if len(messages) > self.max_history_messages:
-                # Keep only the most recent messages
-                self.chat_history.messages = messages[-self.max_history_messages:]
-
-            # Store interaction in background (non-blocking, lazy init)
-            import threading
-            def store_async():
-                try:
-                    self._initialize_vectorstore()
-                    if self.vectorstore:
-                        self._store_interaction(message, reply)
-                except Exception as e:
-                    print(f"Warning: Could not store interaction in vectorstore: {e}")
-            
-            # Start storage in background thread
-            thread = threading.Thread(target=store_async, daemon=True)
-            thread.start()
-            
+
+            self._finalize_reply(message, reply)
+
             return reply
         except Exception as e:
             error_msg = str(e)
             print(f"Error in process_message: {error_msg}")
             raise Exception(f"Failed to process message: {error_msg}")
 
-    def _store_interaction(self, user_message: str, assistant_reply: str) -> None:
-        """Persist the latest exchange to Chroma for future long-term recall."""
+    def stream_message(self, message: str):
+        """Yield reply chunks as they arrive, then persist the full reply.
+
+        Used by the /api/chat/stream endpoint so the browser renders tokens
+        immediately instead of waiting out the whole generation.
+        """
+        try:
+            chain = self._prepare_chain(message)
+
+            parts = []
+            for chunk in chain.stream({"input": message}):
+                content = chunk.content if hasattr(chunk, 'content') else str(chunk)
+                if content:
+                    parts.append(content)
+                    yield content
+
+            reply = "".join(parts)
+            if not reply.strip():
+                reply = "I'm sorry, I couldn't generate a response. Please try again."
+                yield reply
+
+            self._finalize_reply(message, reply)
+        except Exception as e:
+            error_msg = str(e)
+            print(f"Error in stream_message: {error_msg}")
+            yield f"I encountered an error processing your request: {error_msg}. Please try again."
+
+    def _enqueue_interaction(self, user_message: str, assistant_reply: str) -> None:
+        """Queue the exchange for the background storage worker (non-blocking)."""
+        self._ensure_store_worker()
+        self._store_queue.put(("interaction", (user_message, assistant_reply)))
+
+    def _ensure_store_worker(self) -> None:
+        if self._store_worker is not None and self._store_worker.is_alive():
+            return
+        with self._store_worker_lock:
+            if self._store_worker is None or not self._store_worker.is_alive():
+                self._store_worker = threading.Thread(
+                    target=self._store_worker_loop, daemon=True
+                )
+                self._store_worker.start()
+
+    def _store_worker_loop(self) -> None:
+        """Drain queued exchanges and persist them in batches.
+
+        A batch is written when it reaches _flush_every items or when the
+        queue stays quiet for _store_flush_seconds, whichever comes first.
+        """
+        batch = []
+        while True:
+            try:
+                batch.append(self._store_queue.get(timeout=self._store_flush_seconds))
+                if len(batch) < self._flush_every:
+                    continue
+            except queue.Empty:
+                if not batch:
+                    continue
+            self._persist_batch(batch)
+            batch = []
+
+    def _persist_batch(self, batch: list) -> None:
+        """Route a drained queue batch to the right persistence path."""
+        interactions = [payload for kind, payload in batch if kind == "interaction"]
+        user_infos = [payload for kind, payload in batch if kind == "user_info"]
+        if interactions:
+            self._store_interactions(interactions)
+        if user_infos:
+            self._backup_user_info(user_infos)
+
+    def _backup_user_info(self, items: list) -> None:
+        """Write queued user-info snapshots to the Chroma backup collection."""
+        try:
+            self._initialize_vectorstore()
+            if self.user_info_store is None:
+                return
+            documents = [
+                Document(
+                    page_content="\n".join(f"{key}: {value}" for key, value in info.items()),
+                    metadata={"type": "user_info", "timestamp": timestamp},
+                )
+                for info, timestamp in items
+            ]
+            self.user_info_store.add_documents(documents)
+        except Exception as e:
+            print(f"Warning: Could not back up user info: {e}")
+
+    def _flush_pending(self) -> None:
+        """Flush anything still queued or buffered before the process exits."""
+        batch = []
+        while True:
+            try:
+                batch.append(self._store_queue.get_nowait())
+            except queue.Empty:
+                break
+        if batch:
+            self._persist_batch(batch)
+        with self._index_lock:
+            pending = self._pending_flush
+            self._pending_flush = []
+        if pending and self.vectorstore is not None:
+            self._flush_to_store(pending)
+
+    def _store_interactions(self, exchanges: list) -> None:
+        """Persist a batch of exchanges for future long-term recall.
+
+        With FAISS available the whole batch is embedded in one API call,
+        added to the RAM index (immediately searchable) and buffered for a
+        batched Chroma write; otherwise the batch goes to Chroma directly.
+        """
+        try:
+            self._initialize_vectorstore()
+        except Exception as e:
+            print(f"Warning: Could not initialize vectorstore: {e}")
+            return
         if self.vectorstore is None:
             return
         try:
             timestamp = datetime.utcnow().isoformat()
-            document = Document(
-                page_content=f"User: {user_message}\nAssistant: {assistant_reply}",
-                metadata={
-                    "timestamp": timestamp,
-                    "model": self.model_name,
-                },
-            )
-            self.vectorstore.add_documents([document])
+            contents = [
+                f"User: {user_message}\nAssistant: {assistant_reply}"
+                for user_message, assistant_reply in exchanges
+            ]
+            metadatas = [
+                {"timestamp": timestamp, "model": self.model_name}
+                for _ in contents
+            ]
+            if faiss is not None and self._index_ready:
+                vectors = np.ascontiguousarray(
+                    self.embeddings.embed_documents(contents), dtype=np.float32
+                )
+                faiss.normalize_L2(vectors)
+                pending = None
+                with self._index_lock:
+                    if self._faiss_index is None:
+                        self._faiss_index = faiss.IndexFlatIP(vectors.shape[1])
+                    self._faiss_index.add(vectors)
+                    self._faiss_docs.extend(contents)
+                    self._pending_flush.extend(zip(contents, metadatas, vectors.tolist()))
+                    if len(self._pending_flush) >= self._flush_every:
+                        pending = self._pending_flush
+                        self._pending_flush = []
+                if pending:
+                    self._flush_to_store(pending)
+            else:
+                documents = [
+                    Document(page_content=content, metadata=metadata)
+                    for content, metadata in zip(contents, metadatas)
+                ]
+                self.vectorstore.add_documents(documents)
             # Note: persist() is deprecated in newer Chroma versions - persistence is automatic
+            if self._vector_count >= 0:
+                self._vector_count += len(contents)
+            # New memories may change retrieval results, so drop cached ones
+            self.query_cache.invalidate()
         except Exception as e:
             print(f"Warning: Error storing interaction: {e}")
 
+    def _flush_to_store(self, pending: list) -> None:
+        """Write buffered interactions to the durable store in one batch,
+        reusing the vectors already computed for the in-memory index."""
+        if isinstance(self.vectorstore, SqliteVecStore):
+            self.vectorstore.add_batch(
+                [content for content, _, _ in pending],
+                [meta for _, meta, _ in pending],
+                [vec for _, _, vec in pending],
+            )
+            return
+        try:
+            self.vectorstore._collection.upsert(
+                ids=[uuid.uuid4().hex for _ in pending],
+                embeddings=[vec for _, _, vec in pending],
+                documents=[content for content, _, _ in pending],
+                metadatas=[meta for _, meta, _ in pending],
+            )
+        except Exception:
+            # Private collection API changed or unavailable - re-embed via the
+            # public path rather than dropping the batch
+            documents = [Document(page_content=c, metadata=m) for c, m, _ in pending]
+            self.vectorstore.add_documents(documents)
+
     def process_message_with_media(self, message: str, images: list = None) -> str:
         """Generate a reply with media support (images, files, etc.)."""
         try:
@@ -348,27 +856,13 @@ class MaddyBotAgent:
             
             # Retrieve relevant past conversations from database
             relevant_memory = self._retrieve_relevant_memory(message, k=2)
-            
+
             # Build system message with user info
-            system_message = "You are MaddyBot, a helpful AI assistant. Be friendly, concise, and direct. Keep responses brief unless detailed explanation is requested."
-            if user_info.get("name"):
-                system_message += f"\n\nIMPORTANT: The user's name is {user_info['name']}. Always use this name when addressing them. Remember this name for future conversations."
-            
-            if relevant_memory:
-                system_message += f"\n\n{relevant_memory}"
+            system_message = self._build_system_message(user_info, relevant_memory)
             
             # Gemini supports vision! Use gemini-pro-vision for images
             if images and len(images) > 0:
                 try:
-                    # Try to use vision model (gemini-2.5-flash supports vision)
-                    vision_llm = ChatGoogleGenerativeAI(
-                        model="gemini-2.5-flash",
-                        google_api_key=self.api_key,
-                        temperature=0.7,
-                        max_output_tokens=1024,  # Reduced for faster responses
-                        timeout=30,  # 30 second timeout
-                    )
-                    
                     # Build messages with images
                     from langchain_core.messages import HumanMessage, SystemMessage
                     vision_messages = []
@@ -381,17 +875,14 @@ class MaddyBotAgent:
                     recent_history = self._get_recent_history()
                     vision_messages.extend(recent_history)
                     
-                    # Prepare image content for Gemini
-                    import base64
-                    
+                    # Prepare image content for Gemini - images arrive as raw
+                    # bytes, so no base64 decode round trip is needed
                     image_parts = []
                     for img_data in images:
-                        if img_data.get("base64"):
-                            # Decode base64 and create image part
-                            image_bytes = base64.b64decode(img_data["base64"])
+                        if img_data.get("bytes"):
                             image_parts.append({
-                                "mime_type": "image/jpeg",
-                                "data": image_bytes
+                                "mime_type": img_data.get("mime_type", "image/jpeg"),
+                                "data": img_data["bytes"]
                             })
                     
                     # Create message with text and images
@@ -403,27 +894,17 @@ class MaddyBotAgent:
                     
                     vision_messages.append(HumanMessage(content=content_parts))
                     
-                    # Get response from vision model
-                    response = vision_llm.invoke(vision_messages)
+                    # Get response from the shared vision model client
+                    response = self.vision_llm.invoke(vision_messages)
                     reply = response.content if hasattr(response, 'content') else str(response)
                     
                     # Update history
                     self.chat_history.add_message(HumanMessage(content=message or "[Image(s) attached]"))
                     self.chat_history.add_message(AIMessage(content=reply))
                     
-                    # Store interaction
-                    import threading
-                    def store_async():
-                        try:
-                            self._initialize_vectorstore()
-                            if self.vectorstore:
-                                self._store_interaction(message or "[Image(s)]", reply)
-                        except Exception as e:
-                            print(f"Warning: Could not store interaction: {e}")
-                    
-                    thread = threading.Thread(target=store_async, daemon=True)
-                    thread.start()
-                    
+                    # Store interaction in background (non-blocking, batched)
+                    self._enqueue_interaction(message or "[Image(s)]", reply)
+
                     return reply
                     
                 except Exception as vision_error:
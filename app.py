@@ -1,19 +1,75 @@
-from flask import Flask, jsonify, render_template, request
+from flask import Flask, Response, jsonify, render_template, request, stream_with_context
+import asyncio
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
 from agent_core import MaddyBotAgent
+import base64
 import traceback
+
+try:
+    # SIMD base64 kernels; worthwhile for multi-MB image payloads
+    import pybase64 as _b64
+except ImportError:
+    _b64 = base64
+
+try:
+    # C JSON codec; chat payloads carrying file contents or base64 blobs
+    # make stdlib json a measurable per-request cost
+    import orjson
+except ImportError:
+    orjson = None
 import time
 import os
 import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from werkzeug.utils import secure_filename
-from utils.file_processor import extract_text_from_file, process_image, get_file_info
+from utils.file_processor import extract_text_from_file, process_image
 from dotenv import load_dotenv
 
 # Load .env if present
 load_dotenv()
 
+# Log records are dropped onto a bounded queue and formatted/written on a
+# background thread, keeping traceback rendering and stderr syscalls off the
+# request path when an error burst hits.
+_log_queue = queue.Queue(maxsize=1000)
+_log_output = logging.StreamHandler()
+_log_output.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+_log_listener = logging.handlers.QueueListener(_log_queue, _log_output)
+_log_listener.start()
+atexit.register(_log_listener.stop)
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.handlers.QueueHandler(_log_queue))
+logger.setLevel(logging.INFO)
+
+# Attachments within one request are independent, so they are processed
+# concurrently on this pool. Threads suffice: the heavy work either releases
+# the GIL (Pillow/libvips C code) or already fans out to the PDF process pool.
+# Submission happens in batches of the same size so a bulk upload (say 20
+# PDFs) can't queue unbounded in-flight parse state behind the pool.
+_UPLOAD_BATCH = 8
+_upload_pool = ThreadPoolExecutor(max_workers=_UPLOAD_BATCH, thread_name_prefix="upload")
+
 app = Flask(__name__)
 app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024  # 50MB max file size
-app.config['UPLOAD_FOLDER'] = tempfile.gettempdir()
+
+if orjson is not None:
+    from flask.json.provider import JSONProvider
+
+    class _OrjsonProvider(JSONProvider):
+        """Route jsonify/get_json through orjson; falls back silently when absent."""
+
+        def dumps(self, obj, **kwargs):
+            return orjson.dumps(obj).decode('utf-8')
+
+        def loads(self, s, **kwargs):
+            return orjson.loads(s)
+
+    app.json = _OrjsonProvider(app)
 
 # Initialize agent with error handling
 try:
@@ -45,8 +101,65 @@ def favicon():
     return "", 204
 
 
+@app.route("/api/chat/stream", methods=["POST"])
+def chat_stream():
+    """Stream the reply as server-sent events instead of one blocking response."""
+    if agent is None:
+        return jsonify({
+            "reply": "Error: Agent not initialized. Please set GOOGLE_API_KEY or GEMINI_API_KEY in environment."
+        }), 500
+
+    data = (request.get_json() or {}) if request.is_json else {}
+    user_message = (data.get("message") or "").strip()
+    if not user_message:
+        return jsonify({"reply": "I need a message to respond to."}), 400
+
+    def generate():
+        for chunk in agent.stream_message(user_message):
+            yield f"data: {json.dumps(chunk)}\n\n"
+        yield "data: [DONE]\n\n"
+
+    response = Response(stream_with_context(generate()), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"  # Disable proxy buffering
+    return response
+
+
+@app.route("/api/upload", methods=["POST"])
+def upload_raw():
+    """Stream a single raw file body straight into extraction.
+
+    Bypasses the multipart parser entirely for large documents: the body is
+    copied from request.stream in 64 KB chunks into a SpooledTemporaryFile
+    (RAM under 1 MB, disk above), then handed to the extractor. The filename
+    comes from the X-Filename header or a ?filename= query parameter.
+    """
+    name = secure_filename(
+        request.headers.get("X-Filename") or request.args.get("filename", "upload")
+    )
+    ext = os.path.splitext(name)[1].lower()
+    try:
+        with tempfile.SpooledTemporaryFile(max_size=1 << 20) as spool:
+            while True:
+                chunk = request.stream.read(65536)
+                if not chunk:
+                    break
+                spool.write(chunk)
+            spool.seek(0)
+            result = extract_text_from_file(spool, ext)
+        return jsonify({
+            "name": name,
+            "success": result.get("success", False),
+            "content": result.get("content", ""),
+            "metadata": result.get("metadata", {}),
+            "error": result.get("error")
+        })
+    except Exception as e:
+        return jsonify({"name": name, "success": False, "error": str(e)}), 500
+
+
 @app.route("/api/chat", methods=["POST"])
-def chat():
+async def chat():
     # If agent failed to initialize return a clear error
     if agent is None:
         return jsonify({
@@ -65,7 +178,18 @@ def chat():
             data = request.get_json() or {}
             user_message = (data.get("message") or "").strip()
             files_data = data.get("files", [])  # expecting list of dicts {name, content, ...}
-            images_data = data.get("images", [])  # expecting list of base64 parts or metadata
+            # Decode base64 image payloads once at the boundary; everything
+            # downstream works with raw bytes
+            for img in data.get("images", []):
+                if isinstance(img, dict) and img.get("base64"):
+                    try:
+                        images_data.append({
+                            "bytes": _b64.b64decode(img["base64"]),
+                            "mime_type": img.get("mime_type", "image/jpeg"),
+                            "metadata": img.get("metadata", {})
+                        })
+                    except Exception as ex:
+                        images_data.append({"bytes": None, "metadata": {}, "error": str(ex)})
             audio_transcription = (data.get("audio_transcription") or "").strip()
             if audio_transcription:
                 audio_data = {"transcription": audio_transcription, "success": True}
@@ -74,66 +198,71 @@ def chat():
             # Form-data (file uploads)
             user_message = (request.form.get("message") or "").strip()
 
-            # Files
+            # Files - parsed straight from the upload stream, no temp file.
+            # Attachments go to the pool so one slow PDF doesn't serialize
+            # the rest, but in batches of _UPLOAD_BATCH: each batch is
+            # submitted and fully collected before the next starts, which
+            # caps in-flight parse state under bulk uploads while keeping
+            # results in upload order.
+            file_jobs = []
             if 'files' in request.files:
-                uploaded_files = request.files.getlist('files')
-                for file in uploaded_files:
+                for file in request.files.getlist('files'):
                     if file and file.filename:
                         safe_name = secure_filename(file.filename)
-                        temp_path = os.path.join(app.config['UPLOAD_FOLDER'], safe_name)
-                        file.save(temp_path)
-                        try:
-                            file_info = get_file_info(temp_path)
-                            file_result = extract_text_from_file(temp_path, file_info['extension'])
-                            files_data.append({
-                                "name": file_info['name'],
-                                "content": file_result.get("content", ""),
-                                "type": file_info['extension'],
-                                "success": file_result.get("success", False)
-                            })
-                        except Exception as ex:
-                            files_data.append({
-                                "name": safe_name,
-                                "content": "",
-                                "type": os.path.splitext(safe_name)[1],
-                                "success": False,
-                                "error": str(ex)
-                            })
-                        finally:
-                            # remove temp
-                            try:
-                                os.remove(temp_path)
-                            except Exception:
-                                pass
-
-            # Images
+                        ext = os.path.splitext(safe_name)[1].lower()
+                        file_jobs.append((safe_name, ext, file.stream))
+
+            image_jobs = []
             if 'images' in request.files:
-                uploaded_images = request.files.getlist('images')
-                for image in uploaded_images:
+                for image in request.files.getlist('images'):
                     if image and image.filename:
-                        safe_name = secure_filename(image.filename)
-                        temp_path = os.path.join(app.config['UPLOAD_FOLDER'], safe_name)
-                        image.save(temp_path)
-                        try:
-                            image_result = process_image(temp_path)
-                            if image_result.get("success"):
-                                images_data.append({
-                                    "base64": image_result.get("base64"),
-                                    "metadata": image_result.get("metadata", {})
-                                })
-                            else:
-                                images_data.append({
-                                    "base64": None,
-                                    "metadata": {},
-                                    "error": image_result.get("error")
-                                })
-                        except Exception as ex:
-                            images_data.append({"base64": None, "metadata": {}, "error": str(ex)})
-                        finally:
-                            try:
-                                os.remove(temp_path)
-                            except Exception:
-                                pass
+                        image_jobs.append(image.stream)
+
+            for start in range(0, len(file_jobs), _UPLOAD_BATCH):
+                batch = [
+                    (safe_name, ext, _upload_pool.submit(extract_text_from_file, stream, ext))
+                    for safe_name, ext, stream in file_jobs[start:start + _UPLOAD_BATCH]
+                ]
+                for safe_name, ext, future in batch:
+                    try:
+                        file_result = future.result()
+                        files_data.append({
+                            "name": safe_name,
+                            "content": file_result.get("content", ""),
+                            "type": ext,
+                            "success": file_result.get("success", False)
+                        })
+                    except Exception as ex:
+                        files_data.append({
+                            "name": safe_name,
+                            "content": "",
+                            "type": ext,
+                            "success": False,
+                            "error": str(ex)
+                        })
+
+            for start in range(0, len(image_jobs), _UPLOAD_BATCH):
+                batch = [
+                    _upload_pool.submit(process_image, stream)
+                    for stream in image_jobs[start:start + _UPLOAD_BATCH]
+                ]
+                for future in batch:
+                    try:
+                        image_result = future.result()
+                        if image_result.get("success"):
+                            images_data.append({
+                                "bytes": image_result.get("bytes"),
+                                "mime_type": image_result.get("mime_type", "image/jpeg"),
+                                "metadata": image_result.get("metadata", {})
+                            })
+                        else:
+                            images_data.append({
+                                "bytes": None,
+                                "metadata": {},
+                                "error": image_result.get("error")
+                            })
+                    except Exception as ex:
+                        images_data.append({"bytes": None, "metadata": {}, "error": str(ex)})
 
             # Audio transcription from client (if any)
             if 'audio_transcription' in request.form:
@@ -181,34 +310,39 @@ def chat():
         # Process with agent (use media-aware method if images present)
         start_time = time.time()
         try:
+            # The agent round-trip is blocking I/O (LLM API call) - run it on
+            # a worker thread so the handler coroutine doesn't pin the loop
             if images_data:
-                reply = agent.process_message_with_media(full_message, images=images_data)
+                reply = await asyncio.to_thread(
+                    agent.process_message_with_media, full_message, images=images_data
+                )
             else:
-                reply = agent.process_message(full_message)
+                reply = await asyncio.to_thread(agent.process_message, full_message)
         except Exception as e:
             error_msg = str(e)
-            print(f"Agent processing error: {error_msg}")
-            traceback.print_exc()
+            logger.exception("Agent processing error")
             return jsonify({
                 "reply": f"I encountered an error processing your request: {error_msg}. Please try again."
             }), 500
 
         elapsed = time.time() - start_time
-        print(f"Response generated in {elapsed:.2f}s")
+        logger.info("Response generated in %.2fs", elapsed)
         if elapsed > 10:
-            print(f"Warning: Slow response ({elapsed:.2f}s). Consider reducing context size.")
+            logger.warning("Slow response (%.2fs). Consider reducing context size.", elapsed)
 
         return jsonify({"reply": reply})
 
     except Exception as e:
         error_msg = str(e)
-        print(f"Error processing message: {error_msg}")
-        traceback.print_exc()
+        logger.exception("Error processing message")
         return jsonify({
             "reply": f"I encountered an internal error: {error_msg}."
         }), 500
 
 if __name__ == "__main__":
+    # Dev fallback only - production runs under gunicorn (see Procfile).
+    # threaded=True keeps concurrent chats from serializing behind one
+    # in-flight LLM call.
     port = int(os.environ.get("PORT", 5000))
-    app.run(host="0.0.0.0", port=port)
+    app.run(host="0.0.0.0", port=port, threaded=True)
 
@@ -1,8 +1,12 @@
 """Utility functions for processing audio files."""
 import os
 import subprocess
+import time
 from typing import Optional, Dict
-from pathlib import Path
+
+_SUPPORTED_AUDIO = frozenset({'.mp3', '.wav', '.ogg', '.m4a', '.flac'})
+# Stable list form for the API payload; building it per call wastes allocations
+_SUPPORTED_AUDIO_LIST = sorted(_SUPPORTED_AUDIO)
 
 
 def transcribe_audio_with_ollama(audio_path: str, model: str = "llama3") -> Dict[str, any]:
@@ -39,28 +43,40 @@ def transcribe_audio_with_ollama(audio_path: str, model: str = "llama3") -> Dict
 
 def get_audio_info(audio_path: str) -> Dict[str, any]:
     """Get basic audio file information."""
+    name = os.path.basename(audio_path)
     try:
         stat = os.stat(audio_path)
-        ext = Path(audio_path).suffix.lower()
+        ext = os.path.splitext(name)[1].lower()
         return {
-            "name": os.path.basename(audio_path),
+            "name": name,
             "size": stat.st_size,
             "size_mb": round(stat.st_size / (1024 * 1024), 2),
             "extension": ext,
-            "supported_formats": ['.mp3', '.wav', '.ogg', '.m4a', '.flac'],
-            "is_supported": ext in ['.mp3', '.wav', '.ogg', '.m4a', '.flac'],
+            "supported_formats": _SUPPORTED_AUDIO_LIST,
+            "is_supported": ext in _SUPPORTED_AUDIO,
             "exists": True
         }
     except Exception as e:
         return {
-            "name": os.path.basename(audio_path),
+            "name": name,
             "exists": False,
             "error": str(e)
         }
 
 
+# Installed-model checks fork an `ollama list` subprocess; the answer rarely
+# changes, so cache it for a minute instead of paying that per call
+_WHISPER_CHECK_TTL = 60.0
+_whisper_available = None
+_whisper_checked_at = 0.0
+
+
 def check_whisper_available() -> bool:
-    """Check if whisper model is available in Ollama."""
+    """Check if whisper model is available in Ollama (cached for 60s)."""
+    global _whisper_available, _whisper_checked_at
+    now = time.monotonic()
+    if _whisper_available is not None and now - _whisper_checked_at < _WHISPER_CHECK_TTL:
+        return _whisper_available
     try:
         result = subprocess.run(
             ["ollama", "list"],
@@ -68,7 +84,9 @@ def check_whisper_available() -> bool:
             text=True,
             timeout=5
         )
-        return "whisper" in result.stdout.lower()
+        _whisper_available = "whisper" in result.stdout.lower()
     except:
-        return False
+        _whisper_available = False
+    _whisper_checked_at = now
+    return _whisper_available
 
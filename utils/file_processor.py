@@ -1,165 +1,498 @@
 """Utility functions for processing various file types."""
+import hashlib
+import importlib
+import io
+import json
+import mmap
 import os
-import base64
-from typing import Optional, Dict
-from pathlib import Path
-
-try:
-    from PIL import Image
-    PIL_AVAILABLE = True
-except ImportError:
-    PIL_AVAILABLE = False
-
-try:
-    import PyPDF2
-    PDF_AVAILABLE = True
-except ImportError:
-    PDF_AVAILABLE = False
-
-try:
-    from docx import Document
-    DOCX_AVAILABLE = True
-except ImportError:
-    DOCX_AVAILABLE = False
-
-try:
-    import openpyxl
-    EXCEL_AVAILABLE = True
-except ImportError:
-    EXCEL_AVAILABLE = False
-
-
-def extract_text_from_file(file_path: str, file_type: str) -> Dict[str, any]:
-    """Extract text content from various file types."""
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import List, Optional, Dict
+
+# The parsers below are heavy (Pillow, pypdf, python-docx, openpyxl sum to
+# tens of MB and hundreds of ms of import time), so they load lazily on first
+# use instead of at worker startup; formats a worker never sees cost nothing.
+# _load memoizes the module, or None when it isn't installed.
+_MODULES: Dict[str, any] = {}
+
+
+def _load(name: str):
+    if name not in _MODULES:
+        try:
+            _MODULES[name] = importlib.import_module(name)
+        except ImportError:
+            _MODULES[name] = None
+    return _MODULES[name]
+
+
+def _pdf_lib():
+    # pypdf is the maintained successor to PyPDF2 with faster text extraction
+    mod = _load("pypdf")
+    return mod if mod is not None else _load("PyPDF2")
+
+
+# Content-addressed cache for extraction results: users commonly re-upload
+# the same reference document, and PDF parsing is the slowest step by far.
+# Bump the version whenever extraction output changes shape.
+_EXTRACTOR_VERSION = 1
+_CACHE_DIR = os.environ.get(
+    "MADDYBOT_EXTRACT_CACHE",
+    os.path.join(tempfile.gettempdir(), "maddybot-extract-cache"),
+)
+# Formats worth caching - plain text reads are cheaper than the hash
+_CACHEABLE_EXTS = frozenset({'.pdf', '.docx', '.doc', '.xlsx', '.xls'})
+
+
+def _content_digest(stream) -> str:
+    """SHA-256 of a seekable stream, restoring its position afterwards."""
+    pos = stream.tell()
+    if pos == 0:
+        # For real files, hash a memory mapping: it exposes the buffer
+        # protocol, so sha256 digests the kernel-cached pages in one call
+        # with no intermediate bytes allocation. The mapping stays local -
+        # parsers get the ordinary file object (zipfile-based ones poke at
+        # attributes like seekable that mmap lacks before 3.13).
+        try:
+            with mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                return hashlib.sha256(mm).hexdigest()
+        except (AttributeError, ValueError, OSError, io.UnsupportedOperation):
+            pass  # in-memory stream, empty file, or mmap unavailable
+    try:
+        if hasattr(hashlib, "file_digest"):
+            # 3.11+: reads in C, releases the GIL, uses OpenSSL's SHA-NI path
+            return hashlib.file_digest(stream, "sha256").hexdigest()
+        digest = hashlib.sha256()
+        while True:
+            chunk = stream.read(1 << 20)
+            if not chunk:
+                break
+            digest.update(chunk)
+        return digest.hexdigest()
+    finally:
+        stream.seek(pos)
+
+
+def _read_cache(path: str):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception:
+        return None
+
+
+def _write_cache(path: str, payload: dict) -> None:
+    """Atomically persist a cache entry (tmp + rename); failures are silent."""
+    try:
+        os.makedirs(_CACHE_DIR, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=_CACHE_DIR)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(payload, f)
+        os.replace(tmp, path)
+    except Exception:
+        pass
+
+
+# PDFs at or above this page count are split across worker processes;
+# smaller documents aren't worth the pickling/dispatch overhead
+_PARALLEL_PDF_MIN_PAGES = 16
+_PDF_POOL = None
+_PDF_POOL_LOCK = threading.Lock()
+
+
+def _get_pdf_pool() -> ProcessPoolExecutor:
+    """Process-pool singleton, reused across requests to amortize spawn cost."""
+    global _PDF_POOL
+    if _PDF_POOL is None:
+        with _PDF_POOL_LOCK:
+            if _PDF_POOL is None:
+                _PDF_POOL = ProcessPoolExecutor(max_workers=min(4, os.cpu_count() or 1))
+    return _PDF_POOL
+
+
+def _extract_pdf_range(data: bytes, start: int, stop: int) -> List[str]:
+    """Worker: parse the PDF bytes and extract one contiguous page range.
+
+    Module-level so it pickles; each process reopens the document itself,
+    which is cheap next to the pure-Python text extraction it unblocks from
+    the GIL.
+    """
+    reader = _pdf_lib().PdfReader(io.BytesIO(data))
+    return [reader.pages[i].extract_text() for i in range(start, stop)]
+
+
+def _extract_pages_parallel(stream, num_pages: int) -> Optional[List[str]]:
+    """Fan page extraction out over the process pool; None means fall back."""
+    try:
+        stream.seek(0)
+        data = stream.read()
+        pool = _get_pdf_pool()
+        workers = pool._max_workers
+        step = -(-num_pages // workers)  # ceil division
+        futures = [
+            pool.submit(_extract_pdf_range, data, start, min(start + step, num_pages))
+            for start in range(0, num_pages, step)
+        ]
+        texts: List[str] = []
+        for future in futures:
+            texts.extend(future.result())
+        return texts
+    except Exception:
+        return None
+
+
+# Handlers return False when their parser isn't installed, which the
+# dispatcher reports as an unsupported type
+
+def _extract_text(stream, result: dict) -> None:
+    result["content"] = stream.read().decode('utf-8', errors='ignore')
+    result["success"] = True
+    result["metadata"] = {"type": "text", "encoding": "utf-8"}
+
+
+def _extract_pdf(stream, result: dict):
+    pdf = _pdf_lib()
+    if pdf is None:
+        return False
+    pdf_reader = pdf.PdfReader(stream)
+    num_pages = len(pdf_reader.pages)
+    result["metadata"]["pages"] = num_pages
+    page_texts = None
+    if num_pages >= _PARALLEL_PDF_MIN_PAGES and stream.seekable():
+        page_texts = _extract_pages_parallel(stream, num_pages)
+    # Write pages into one growing buffer rather than a list + join, which
+    # briefly holds the document text twice for very long PDFs
+    buf = io.StringIO()
+    if page_texts is not None:
+        for i, text in enumerate(page_texts):
+            buf.write(f"--- Page {i + 1} ---\n")
+            buf.write(text or "")
+            buf.write("\n\n")
+    else:
+        for i, page in enumerate(pdf_reader.pages):
+            buf.write(f"--- Page {i + 1} ---\n")
+            buf.write(page.extract_text() or "")
+            buf.write("\n\n")
+    result["content"] = buf.getvalue().rstrip("\n")
+    result["success"] = True
+    result["metadata"]["type"] = "pdf"
+
+
+def _extract_docx(stream, result: dict):
+    docx = _load("docx")
+    if docx is None:
+        return False
+    doc = docx.Document(stream)
+    paragraphs = [para.text for para in doc.paragraphs]
+    result["content"] = "\n".join(paragraphs)
+    result["success"] = True
+    result["metadata"] = {"type": "docx", "paragraphs": len(paragraphs)}
+
+
+def _extract_excel(stream, result: dict):
+    openpyxl = _load("openpyxl")
+    if openpyxl is None:
+        return False
+    # read_only streams rows instead of building the full cell graph;
+    # data_only returns computed values rather than formula strings
+    workbook = openpyxl.load_workbook(stream, read_only=True, data_only=True)
+    sheet_names = [ws.title for ws in workbook.worksheets]
+
+    def _excel_lines():
+        for ws in workbook.worksheets:
+            yield f"--- Sheet: {ws.title} ---"
+            for row in ws.iter_rows(values_only=True):
+                yield "\t".join("" if cell is None else str(cell) for cell in row)
+
+    result["content"] = "\n".join(_excel_lines())
+    workbook.close()
+    result["success"] = True
+    result["metadata"] = {"type": "excel", "sheets": sheet_names}
+
+
+_TEXT_EXTS = frozenset({'.txt', '.md', '.py', '.js', '.html', '.css', '.json',
+                        '.xml', '.csv', '.log'})
+
+# Extension -> handler; unregistered extensions (and handlers whose backing
+# library turns out to be missing) get the unsupported-type message. Adding
+# a format is a one-line registration here.
+_EXTRACTORS: Dict[str, any] = {ext: _extract_text for ext in _TEXT_EXTS}
+_EXTRACTORS['.pdf'] = _extract_pdf
+_EXTRACTORS['.docx'] = _EXTRACTORS['.doc'] = _extract_docx
+_EXTRACTORS['.xlsx'] = _EXTRACTORS['.xls'] = _extract_excel
+
+
+def extract_text_from_file(source, file_type: str) -> Dict[str, any]:
+    """Extract text content from various file types.
+
+    Accepts a filesystem path or a binary file-like object (e.g. the upload
+    stream from werkzeug), so uploads can be parsed without a temp-file
+    round trip through disk. For streams the extension comes from file_type.
+    """
     result = {
         "success": False,
         "content": "",
         "metadata": {},
         "error": None
     }
-    
+
+    opened_here = []
     try:
-        file_ext = Path(file_path).suffix.lower()
-        
-        # Text files
-        if file_ext in ['.txt', '.md', '.py', '.js', '.html', '.css', '.json', '.xml', '.csv', '.log']:
-            with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                result["content"] = f.read()
-                result["success"] = True
-                result["metadata"] = {"type": "text", "encoding": "utf-8"}
-        
-        # PDF files
-        elif file_ext == '.pdf' and PDF_AVAILABLE:
-            text_content = []
-            with open(file_path, 'rb') as f:
-                pdf_reader = PyPDF2.PdfReader(f)
-                result["metadata"]["pages"] = len(pdf_reader.pages)
-                for page_num, page in enumerate(pdf_reader.pages):
-                    text_content.append(f"--- Page {page_num + 1} ---\n{page.extract_text()}")
-                result["content"] = "\n\n".join(text_content)
-                result["success"] = True
-                result["metadata"]["type"] = "pdf"
-        
-        # Word documents
-        elif file_ext in ['.docx', '.doc'] and DOCX_AVAILABLE:
-            doc = Document(file_path)
-            paragraphs = [para.text for para in doc.paragraphs]
-            result["content"] = "\n".join(paragraphs)
-            result["success"] = True
-            result["metadata"] = {"type": "docx", "paragraphs": len(paragraphs)}
-        
-        # Excel files
-        elif file_ext in ['.xlsx', '.xls'] and EXCEL_AVAILABLE:
-            workbook = openpyxl.load_workbook(file_path)
-            content_parts = []
-            for sheet_name in workbook.sheetnames:
-                sheet = workbook[sheet_name]
-                content_parts.append(f"--- Sheet: {sheet_name} ---")
-                for row in sheet.iter_rows(values_only=True):
-                    row_text = "\t".join(str(cell) if cell is not None else "" for cell in row)
-                    content_parts.append(row_text)
-            result["content"] = "\n".join(content_parts)
-            result["success"] = True
-            result["metadata"] = {"type": "excel", "sheets": workbook.sheetnames}
-        
+        if hasattr(source, "read"):
+            stream = source
+            file_ext = (file_type or "").lower()
         else:
+            file_ext = os.path.splitext(source)[1].lower()
+            stream = open(source, 'rb')
+            opened_here.append(stream)
+
+        # Re-uploaded documents hit the content-addressed cache: one hash
+        # plus a JSON read instead of a full re-parse
+        cache_path = None
+        if file_ext in _CACHEABLE_EXTS and stream.seekable():
+            digest = _content_digest(stream)
+            cache_path = os.path.join(
+                _CACHE_DIR, f"{digest}{file_ext}.v{_EXTRACTOR_VERSION}.json"
+            )
+            cached = _read_cache(cache_path)
+            if cached is not None:
+                return cached["result"]
+
+        handler = _EXTRACTORS.get(file_ext)
+        if handler is None or handler(stream, result) is False:
             result["error"] = f"Unsupported file type: {file_ext}"
             result["content"] = f"[File type {file_ext} is not yet supported for text extraction]"
             result["success"] = False
-    
+
     except Exception as e:
         result["error"] = str(e)
         result["success"] = False
-    
+    finally:
+        for handle in reversed(opened_here):
+            handle.close()
+
+    if result["success"] and cache_path is not None:
+        _write_cache(cache_path, {
+            "result": result,
+            "cached_at": datetime.utcnow().isoformat(),
+            "version": _EXTRACTOR_VERSION,
+        })
+
     return result
 
 
-def process_image(image_path: str) -> Dict[str, any]:
-    """Process image file and return base64 encoded data."""
+# Resize/encode parameters; part of the image cache key so changing them
+# invalidates old entries
+_IMAGE_MAX_SIZE = 2048
+_IMAGE_QUALITY = 85
+
+
+def _passthrough_jpeg(source, result: dict) -> bool:
+    """Hand back the original bytes for JPEGs already within limits.
+
+    Image.open only parses the header until pixels are requested, so the
+    probe costs a few KB of reads - skipping the decode/resize/encode round
+    trip that dominates CPU for the common already-small upload.
+    """
+    Image = _load("PIL.Image")
+    if Image is None:
+        return False
+    pos = source.tell() if hasattr(source, "read") else None
+    try:
+        with Image.open(source) as img:
+            fmt, mode, size = img.format, img.mode, img.size
+        if fmt != 'JPEG' or mode not in ('RGB', 'L') or max(size) > _IMAGE_MAX_SIZE:
+            return False
+        if pos is not None:
+            source.seek(pos)
+            data = source.read()
+        else:
+            with open(source, 'rb') as f:
+                data = f.read()
+        result["metadata"] = {
+            "format": fmt,
+            "mode": mode,
+            "size": size,
+            "width": size[0],
+            "height": size[1],
+            "passthrough": True
+        }
+        result["bytes"] = data
+        result["success"] = True
+        return True
+    except Exception:
+        return False
+    finally:
+        if pos is not None:
+            try:
+                source.seek(pos)
+            except Exception:
+                pass
+
+
+def process_image(source) -> Dict[str, any]:
+    """Process an image (path or binary file-like) into raw JPEG bytes."""
     result = {
         "success": False,
-        "base64": None,
+        "bytes": None,
+        "mime_type": "image/jpeg",
         "metadata": {},
         "error": None
     }
-    
-    if not PIL_AVAILABLE:
+
+    if _load("pyvips") is None and _load("PIL.Image") is None:
         result["error"] = "PIL/Pillow not available"
         return result
-    
+
+    # Content-addressed cache: re-uploaded images skip the decode/resize/
+    # encode entirely. JPEG bytes live next to a JSON metadata sidecar.
+    cache_base = None
     try:
-        with Image.open(image_path) as img:
+        if hasattr(source, "read") and source.seekable():
+            digest = _content_digest(source)
+        else:
+            with open(source, 'rb') as f:
+                digest = _content_digest(f)
+        cache_base = os.path.join(
+            _CACHE_DIR, f"{digest}.img{_IMAGE_MAX_SIZE}q{_IMAGE_QUALITY}"
+        )
+        cached = _read_cache(cache_base + ".json")
+        if cached is not None:
+            with open(cache_base + ".jpg", 'rb') as f:
+                result.update(cached["result"])
+                result["bytes"] = f.read()
+                return result
+    except Exception:
+        pass  # Cache miss or unreadable entry - process normally
+
+    if _passthrough_jpeg(source, result):
+        return result  # original bytes, unmodified; nothing worth caching
+
+    if _process_image_vips(source, result):
+        pass  # encoded via libvips; fall through to the cache write below
+    elif _load("PIL.Image") is None:
+        result["error"] = "Image processing failed and PIL/Pillow not available"
+    else:
+        _process_image_pil(source, result)
+
+    if result["success"] and cache_base is not None:
+        try:
+            os.makedirs(_CACHE_DIR, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=_CACHE_DIR)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(result["bytes"])
+            os.replace(tmp, cache_base + ".jpg")
+            _write_cache(cache_base + ".json", {
+                "result": {k: v for k, v in result.items() if k != "bytes"},
+                "cached_at": datetime.utcnow().isoformat(),
+            })
+        except Exception:
+            pass
+
+    return result
+
+
+def _process_image_vips(source, result: dict) -> bool:
+    """Resize/encode through libvips; returns False to fall back to Pillow.
+
+    libvips resizes/encodes with SIMD and streams tiles instead of holding
+    the full decoded bitmap, so it is preferred over Pillow when installed.
+    """
+    pyvips = _load("pyvips")
+    if pyvips is None:
+        return False
+    try:
+        if hasattr(source, "read"):
+            pos = source.tell()
+            data = source.read()
+            source.seek(pos)
+        else:
+            with open(source, 'rb') as f:
+                data = f.read()
+        # Header-only open: gives dimensions without decoding pixels
+        header = pyvips.Image.new_from_buffer(data, "")
+        # Report the source format/mode like the Pillow path does: the
+        # loader name encodes the format ("pngload_buffer" -> PNG) and the
+        # band count maps onto Pillow's mode strings
+        try:
+            loader = header.get("vips-loader")
+            fmt = loader.replace("load_buffer", "").replace("load", "").upper() or None
+        except Exception:
+            fmt = None
+        mode = {1: "L", 2: "LA", 3: "RGB", 4: "RGBA"}.get(header.bands)
+        result["metadata"] = {
+            "format": fmt,
+            "mode": mode,
+            "size": (header.width, header.height),
+            "width": header.width,
+            "height": header.height
+        }
+        img = pyvips.Image.thumbnail_buffer(data, _IMAGE_MAX_SIZE, size="down")
+        if (img.width, img.height) != (header.width, header.height):
+            result["metadata"]["resized"] = True
+            result["metadata"]["original_size"] = (header.width, header.height)
+        result["bytes"] = img.jpegsave_buffer(Q=_IMAGE_QUALITY)
+        result["success"] = True
+        return True
+    except Exception:
+        result["metadata"] = {}
+        return False
+
+
+def _process_image_pil(source, result: dict) -> None:
+    """Stock Pillow path (also benefits from Pillow-SIMD when installed)."""
+    Image = _load("PIL.Image")
+    try:
+        # PIL accepts both paths and file-like objects
+        with Image.open(source) as img:
             # Get image metadata
+            orig_size = img.size
             result["metadata"] = {
                 "format": img.format,
                 "mode": img.mode,
-                "size": img.size,
+                "size": orig_size,
                 "width": img.width,
                 "height": img.height
             }
-            
+
             # Convert to RGB if necessary (for JPEG compatibility)
             if img.mode != 'RGB':
                 img = img.convert('RGB')
-            
-            # Resize if too large (max 2048px on longest side)
-            max_size = 2048
-            if max(img.size) > max_size:
-                ratio = max_size / max(img.size)
-                new_size = (int(img.width * ratio), int(img.height * ratio))
-                img = img.resize(new_size, Image.Resampling.LANCZOS)
+
+            # Resize if too large (max 2048px on longest side); thumbnail
+            # resizes in place, skipping the second full-bitmap allocation
+            if max(orig_size) > _IMAGE_MAX_SIZE:
+                img.thumbnail((_IMAGE_MAX_SIZE, _IMAGE_MAX_SIZE), Image.Resampling.LANCZOS)
                 result["metadata"]["resized"] = True
-                result["metadata"]["original_size"] = img.size
-            
-            # Save to bytes and encode to base64
-            import io
+                result["metadata"]["original_size"] = orig_size
+
+            # Encode once to JPEG bytes; downstream consumers take raw bytes
             buffer = io.BytesIO()
-            img.save(buffer, format='JPEG', quality=85)
-            buffer.seek(0)
-            result["base64"] = base64.b64encode(buffer.read()).decode('utf-8')
+            img.save(buffer, format='JPEG', quality=_IMAGE_QUALITY)
+            result["bytes"] = buffer.getvalue()
             result["success"] = True
-    
+
     except Exception as e:
         result["error"] = str(e)
         result["success"] = False
-    
-    return result
 
 
 def get_file_info(file_path: str) -> Dict[str, any]:
     """Get basic file information."""
+    name = os.path.basename(file_path)
     try:
         stat = os.stat(file_path)
         return {
-            "name": os.path.basename(file_path),
+            "name": name,
             "size": stat.st_size,
             "size_mb": round(stat.st_size / (1024 * 1024), 2),
-            "extension": Path(file_path).suffix.lower(),
+            "extension": os.path.splitext(name)[1].lower(),
             "exists": True
         }
     except Exception as e:
         return {
-            "name": os.path.basename(file_path),
+            "name": name,
             "exists": False,
             "error": str(e)
         }
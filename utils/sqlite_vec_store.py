@@ -0,0 +1,211 @@
+"""SQLite-backed conversation-memory store using the sqlite-vec extension.
+
+Implements the small slice of the Chroma vectorstore API the agent relies on
+(similarity_search_by_vector / add_documents / get / batched adds) on top of
+a single SQLite file with a vec0 virtual table. KNN through vec0 stays in the
+embedded C extension, avoiding a separate server process and Chroma's HNSW +
+SQLite bookkeeping per query. When the extension fails to load, the store
+falls back to brute-force cosine over a plain table.
+"""
+
+import sqlite3
+import threading
+from typing import Dict, List, Optional
+
+import numpy as np
+from langchain_core.documents import Document
+
+try:
+    import sqlite_vec
+except ImportError:
+    sqlite_vec = None
+
+
+# Brute-force search shortlists this many candidates with int8 arithmetic
+# before the exact FP32 re-rank
+_SHORTLIST_SIZE = 50
+
+
+def _quantize(vectors: np.ndarray):
+    """Scalar-quantize row vectors to int8 with per-row scale factors."""
+    scales = np.abs(vectors).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    quantized = np.round(vectors / scales[:, None]).astype(np.int8)
+    return quantized, scales.astype(np.float32)
+
+
+class SqliteVecStore:
+    """Vector store over one SQLite file; vec0 KNN with brute-force fallback."""
+
+    def __init__(self, db_path: str, embedding_function=None) -> None:
+        self.db_path = db_path
+        self.embedding_function = embedding_function
+        self._lock = threading.Lock()
+        self._vec_loaded = False
+        self._table_ready = False
+        # int8 RAM cache for the brute-force path: the full scan touches a
+        # quarter of the bytes of FP32; FP32 rows are fetched from disk only
+        # for the shortlisted candidates
+        self._quant = None
+        self._scales = None
+        self._ids: List[int] = []
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        if sqlite_vec is not None:
+            try:
+                self._conn.enable_load_extension(True)
+                sqlite_vec.load(self._conn)
+                self._conn.enable_load_extension(False)
+                self._vec_loaded = True
+            except Exception as e:
+                print(f"Warning: sqlite-vec extension unavailable, using brute-force search: {e}")
+        if not self._vec_loaded:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS mem "
+                "(id INTEGER PRIMARY KEY, content TEXT, ts TEXT, model TEXT, embedding BLOB)"
+            )
+            self._conn.commit()
+            self._table_ready = True
+            self._load_quant_cache()
+        else:
+            # The vec0 table needs the embedding dimension, which we only
+            # know once the first vector arrives (or the table already exists)
+            row = self._conn.execute(
+                "SELECT name FROM sqlite_master WHERE name = 'vec_mem'"
+            ).fetchone()
+            self._table_ready = row is not None
+
+    @classmethod
+    def create(cls, db_path: str, embedding_function=None) -> Optional["SqliteVecStore"]:
+        """Return a store, or None when sqlite-vec is not installed."""
+        if sqlite_vec is None:
+            return None
+        try:
+            return cls(db_path, embedding_function)
+        except Exception as e:
+            print(f"Warning: Could not open sqlite-vec store: {e}")
+            return None
+
+    def _load_quant_cache(self) -> None:
+        """Build the int8 shortlist cache from rows persisted in earlier runs."""
+        rows = self._conn.execute("SELECT id, embedding FROM mem").fetchall()
+        if not rows:
+            return
+        vectors = np.vstack([np.frombuffer(row[1], dtype=np.float32) for row in rows])
+        self._quant, self._scales = _quantize(vectors)
+        self._ids = [row[0] for row in rows]
+
+    def _append_quant(self, vectors: np.ndarray, ids: List[int]) -> None:
+        quantized, scales = _quantize(vectors)
+        if self._quant is None:
+            self._quant, self._scales = quantized, scales
+        else:
+            self._quant = np.vstack([self._quant, quantized])
+            self._scales = np.concatenate([self._scales, scales])
+        self._ids.extend(ids)
+
+    def _ensure_table(self, dim: int) -> None:
+        if self._table_ready:
+            return
+        # Vectors are L2-normalized upstream, so the default L2 distance
+        # orders identically to cosine
+        self._conn.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS vec_mem USING vec0("
+            f"embedding FLOAT[{dim}], +content TEXT, +ts TEXT, +model TEXT)"
+        )
+        self._conn.commit()
+        self._table_ready = True
+
+    def add_batch(self, contents: List[str], metadatas: List[dict], vectors: List[list]) -> None:
+        """Insert precomputed (content, metadata, vector) rows in one transaction."""
+        if not contents:
+            return
+        rows = [
+            (
+                np.asarray(vector, dtype=np.float32).tobytes(),
+                content,
+                (metadata or {}).get("timestamp", ""),
+                (metadata or {}).get("model", ""),
+            )
+            for content, metadata, vector in zip(contents, metadatas, vectors)
+        ]
+        with self._lock:
+            if self._vec_loaded:
+                self._ensure_table(len(vectors[0]))
+                self._conn.executemany(
+                    "INSERT INTO vec_mem(embedding, content, ts, model) VALUES (?, ?, ?, ?)",
+                    rows,
+                )
+            else:
+                cursor = self._conn.cursor()
+                ids = []
+                for row in rows:
+                    cursor.execute(
+                        "INSERT INTO mem(embedding, content, ts, model) VALUES (?, ?, ?, ?)",
+                        row,
+                    )
+                    ids.append(cursor.lastrowid)
+                self._append_quant(
+                    np.asarray(vectors, dtype=np.float32), ids
+                )
+            self._conn.commit()
+
+    def add_documents(self, documents: List[Document]) -> None:
+        """Embed and insert documents (compatibility with the Chroma call site)."""
+        if not documents or self.embedding_function is None:
+            return
+        contents = [doc.page_content for doc in documents]
+        vectors = self.embedding_function.embed_documents(contents)
+        self.add_batch(contents, [doc.metadata for doc in documents], vectors)
+
+    def similarity_search_by_vector(self, embedding: list, k: int = 4) -> List[Document]:
+        """Return the k nearest stored exchanges for a query vector."""
+        query = np.ascontiguousarray(embedding, dtype=np.float32)
+        with self._lock:
+            if not self._table_ready:
+                return []
+            if self._vec_loaded:
+                rows = self._conn.execute(
+                    "SELECT content FROM vec_mem WHERE embedding MATCH ? "
+                    "ORDER BY distance LIMIT ?",
+                    (query.tobytes(), k),
+                ).fetchall()
+                return [Document(page_content=row[0]) for row in rows]
+            if self._quant is None or not self._ids:
+                return []
+            # int8 shortlist: approximate dot products over the quantized
+            # cache, touching a quarter of the FP32 bytes
+            q_quant, q_scales = _quantize(query[None, :])
+            approx = (self._quant @ q_quant[0].astype(np.int32)).astype(np.float32)
+            approx *= self._scales * q_scales[0]
+            shortlist = np.argsort(approx)[::-1][:_SHORTLIST_SIZE]
+            candidate_ids = [self._ids[i] for i in shortlist]
+            placeholders = ",".join("?" for _ in candidate_ids)
+            rows = self._conn.execute(
+                f"SELECT content, embedding FROM mem WHERE id IN ({placeholders})",
+                candidate_ids,
+            ).fetchall()
+        if not rows:
+            return []
+        # Exact FP32 re-rank over the shortlist only
+        vectors = np.vstack([np.frombuffer(row[1], dtype=np.float32) for row in rows])
+        scores = vectors @ query
+        top = np.argsort(scores)[::-1][:k]
+        return [Document(page_content=rows[i][0]) for i in top]
+
+    def get(self, include: Optional[List[str]] = None) -> Dict[str, list]:
+        """Return all documents/embeddings (mirrors Chroma's collection get)."""
+        table = "vec_mem" if self._vec_loaded else "mem"
+        with self._lock:
+            if not self._table_ready:
+                return {"documents": [], "embeddings": []}
+            rows = self._conn.execute(f"SELECT content, embedding FROM {table}").fetchall()
+        documents = [row[0] for row in rows]
+        embeddings = [np.frombuffer(row[1], dtype=np.float32).tolist() for row in rows]
+        return {"documents": documents, "embeddings": embeddings}
+
+    def count(self) -> int:
+        table = "vec_mem" if self._vec_loaded else "mem"
+        with self._lock:
+            if not self._table_ready:
+                return 0
+            return self._conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]